@@ -8,5 +8,16 @@ __author__ = "Ari Reddy"
 from .caption import CaptionGenerator
 from .gps import GPSExtractor
 from .embed import XMPEmbedder
+from .ratelimit import RateLimiter
+from .cache import CaptionCache
+from .providers import PROVIDERS, ProviderAdapter
 
-__all__ = ["CaptionGenerator", "GPSExtractor", "XMPEmbedder"]
+__all__ = [
+    "CaptionGenerator",
+    "GPSExtractor",
+    "XMPEmbedder",
+    "RateLimiter",
+    "CaptionCache",
+    "PROVIDERS",
+    "ProviderAdapter",
+]
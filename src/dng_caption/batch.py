@@ -1,12 +1,16 @@
 """Batch processing functionality"""
 
 import sys
+import logging
 from pathlib import Path
 from typing import List, Dict
 import time
-from .caption import CaptionGenerator
+from .caption import PILLOW_SIMD, PILLOW_SIMD_HINT, CaptionGenerator
 from .gps import GPSExtractor
 from .embed import XMPEmbedder
+from .providers import PROVIDERS
+
+logger = logging.getLogger(__name__)
 
 
 class BatchProcessor:
@@ -55,6 +59,17 @@ class BatchProcessor:
             print("📍 GPS extraction enabled")
         print("-" * 40)
         
+        # Read GPS for every image that will be processed in one pass
+        gps_by_path = {}
+        if use_gps:
+            pending = [
+                path for path in jpeg_files
+                if not (skip_existing and path.with_suffix('.xmp').exists())
+            ]
+            gps_by_path = dict(zip(
+                pending, self.gps_extractor.extract_gps_batch(pending)
+            ))
+        
         for i, jpeg_path in enumerate(jpeg_files, 1):
             # Check if should skip
             if skip_existing:
@@ -72,7 +87,7 @@ class BatchProcessor:
                 location_name = None
                 
                 if use_gps:
-                    if gps_data := self.gps_extractor.extract_gps(jpeg_path):
+                    if gps_data := gps_by_path.get(jpeg_path):
                         self.stats['with_gps'] += 1
                         
                         if location := self.gps_extractor.reverse_geocode(
@@ -125,7 +140,7 @@ def main():
     )
     parser.add_argument('folder', help='Folder containing images')
     parser.add_argument('--provider', default='claude',
-                       choices=['claude', 'openai'],
+                       choices=list(PROVIDERS),
                        help='AI provider to use (default: claude)')
     parser.add_argument('--model',
                        help='Model to use. Claude: haiku, sonnet, opus. OpenAI: gpt-4o, gpt-4o-mini, gpt-4-turbo')
@@ -138,9 +153,18 @@ def main():
                        help='Create sidecars only, don\'t embed')
     parser.add_argument('--no-gps', action='store_true',
                        help='Disable GPS extraction')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                       help='Show informational messages')
 
     args = parser.parse_args()
 
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(message)s'
+    )
+    if not PILLOW_SIMD:
+        logger.info(PILLOW_SIMD_HINT)
+
     folder_path = Path(args.folder)
     if not folder_path.exists():
         print(f"Error: {folder_path} does not exist")
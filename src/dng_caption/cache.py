@@ -0,0 +1,226 @@
+"""Persistent caption cache"""
+
+import functools
+import hashlib
+import struct
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple
+from diskcache import Cache
+from PIL import Image
+
+try:
+    from blake3 import blake3 as _hasher
+except ImportError:  # optional, see the 'performance' extra
+    _hasher = hashlib.blake2b
+
+CAPTION_CACHE_DIR = Path("~/.cache/dng-caption/captions").expanduser()
+
+# JPEG markers carrying metadata rather than image data: APP0-APP15, COM
+_JPEG_METADATA_MARKERS = frozenset(range(0xE0, 0xF0)) | {0xFE}
+
+# TIFF tags: StripOffsets, StripByteCounts, TileOffsets, TileByteCounts,
+# SubIFDs (where DNG keeps the full-size raw image)
+_TIFF_DATA_TAGS = {273, 279, 324, 325, 330}
+
+# Byte size of the TIFF SHORT, LONG and IFD field types
+_TIFF_TYPE_SIZES = {3: 2, 4: 4, 13: 4}
+
+_READ_SIZE = 1 << 20
+
+
+class CaptionCache:
+    """Reuse captions for images that were already captioned
+
+    Entries are keyed by a hash of the image data together with everything
+    sent to the API, so renamed, copied or re-tagged files still hit, while
+    edited pixels, prompts or models miss.
+    """
+
+    def __init__(self, cache_dir: Path = CAPTION_CACHE_DIR):
+        """Open (or create) the cache in cache_dir"""
+        self.cache = Cache(str(cache_dir))
+
+    def key(
+        self, image_path: Path, provider: str, model: str, prompt: str, base_prompt: str
+    ) -> Tuple:
+        """Build the cache key for a caption request
+
+        Args:
+            image_path: Image file sent with the request
+            provider: Provider name
+            model: Model id sent to the API
+            prompt: Full prompt sent with the image
+            base_prompt: The same prompt without location context, see
+                        contains()
+        """
+        stat = Path(image_path).stat()
+        digest = _file_digest(str(image_path), stat.st_mtime_ns, stat.st_size)
+        # Hash name keeps blake3 and blake2b digests from ever colliding
+        return (_hasher.__name__, digest, provider, model, base_prompt, prompt)
+
+    def contains(
+        self, image_path: Path, provider: str, model: str, base_prompt: str
+    ) -> bool:
+        """Whether a caption is cached for these settings at any location
+
+        Lets callers decide whether to start work that only a cache miss
+        needs before the location context is known.
+        """
+        key = self.key(image_path, provider, model, base_prompt, base_prompt)
+        return self.cache.get(key[:-1]) is not None
+
+    def get(self, key: Tuple) -> Optional[str]:
+        """Return the cached caption, or None"""
+        return self.cache.get(key)
+
+    def set(self, key: Tuple, caption: str):
+        """Store a caption"""
+        self.cache.set(key, caption)
+        # Location-independent marker for contains()
+        self.cache.set(key[:-1], True)
+
+
+@functools.lru_cache(maxsize=1024)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    """Hash the image data in a file; mtime and size make edited files miss
+
+    Metadata is left out, so writing a caption into the file (--embed)
+    doesn't invalidate its cache entry. Files that can't be parsed are
+    hashed whole.
+    """
+    with open(path, "rb") as f:
+        try:
+            hasher = _hasher()
+            for data in _image_data(f):
+                hasher.update(data)
+            return hasher.hexdigest()
+        except (ValueError, IndexError, struct.error, OSError):
+            pass
+
+        f.seek(0)
+        hasher = _hasher()
+        while data := f.read(_READ_SIZE):
+            hasher.update(data)
+        return hasher.hexdigest()
+
+
+def _image_data(f: BinaryIO) -> Iterator[bytes]:
+    """Yield the parts of an image file that make up the picture"""
+    magic = f.read(4)
+    f.seek(0)
+    if magic[:2] == b"\xff\xd8":
+        chunks = _jpeg_data(f.read())
+    elif magic in (b"II*\x00", b"MM\x00*"):
+        chunks = _tiff_data(f)
+    else:
+        chunks = _decoded_pixels(f)
+
+    found = False
+    for data in chunks:
+        found = True
+        yield data
+    if not found:
+        # Never let every unparseable file share one digest
+        raise ValueError("No image data found")
+
+
+def _jpeg_data(data: bytes) -> Iterator[bytes]:
+    """Yield a JPEG's segments and scan data, skipping APPn/COM metadata"""
+    view = memoryview(data)
+    pos = 2
+    while True:
+        if data[pos] != 0xFF:
+            raise ValueError("Expected a JPEG marker")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            pos += 1
+            continue
+        if marker == 0xD9:
+            return
+
+        end = pos + 2 + int.from_bytes(data[pos + 2 : pos + 4], "big")
+        if marker not in _JPEG_METADATA_MARKERS:
+            yield view[pos:end]
+        pos = end
+
+        if marker == 0xDA:
+            # Entropy-coded data runs up to the next marker; 0xFF00 is an
+            # escaped 0xFF byte and RST0-7 are part of the scan
+            scan_end = pos
+            while True:
+                scan_end = data.index(b"\xff", scan_end)
+                following = data[scan_end + 1]
+                if following == 0x00 or 0xD0 <= following <= 0xD7:
+                    scan_end += 2
+                elif following == 0xFF:
+                    scan_end += 1
+                else:
+                    break
+            yield view[pos:scan_end]
+            pos = scan_end
+
+
+def _tiff_data(f: BinaryIO) -> Iterator[bytes]:
+    """Yield the strip and tile data of every image in a TIFF or DNG file"""
+    header = f.read(8)
+    order = "<" if header[:2] == b"II" else ">"
+    pending = [struct.unpack(order + "I", header[4:8])[0]]
+    seen = set()
+    while pending:
+        offset = pending.pop(0)
+        if not offset or offset in seen:
+            continue
+        seen.add(offset)
+
+        f.seek(offset)
+        (count,) = struct.unpack(order + "H", f.read(2))
+        entries = f.read(count * 12)
+        (next_ifd,) = struct.unpack(order + "I", f.read(4))
+
+        tags = {}
+        for i in range(count):
+            tag, field_type, n, value = struct.unpack(
+                order + "HHI4s", entries[i * 12 : i * 12 + 12]
+            )
+            if tag in _TIFF_DATA_TAGS and field_type in _TIFF_TYPE_SIZES:
+                tags[tag] = _tiff_values(f, order, field_type, n, value)
+
+        pending.extend(tags.get(330, ()))
+        pending.append(next_ifd)
+
+        for offsets_tag, counts_tag in ((273, 279), (324, 325)):
+            for start, length in zip(
+                tags.get(offsets_tag, ()), tags.get(counts_tag, ())
+            ):
+                f.seek(start)
+                while length > 0:
+                    data = f.read(min(length, _READ_SIZE))
+                    if not data:
+                        raise ValueError("Truncated TIFF image data")
+                    length -= len(data)
+                    yield data
+
+
+def _tiff_values(
+    f: BinaryIO, order: str, field_type: int, count: int, value: bytes
+) -> Tuple[int, ...]:
+    """Read the integer values of a TIFF IFD entry"""
+    size = _TIFF_TYPE_SIZES[field_type]
+    fmt = order + ("H" if size == 2 else "I") * count
+    if size * count <= 4:
+        return struct.unpack(fmt, value[: size * count])
+
+    (offset,) = struct.unpack(order + "I", value)
+    position = f.tell()
+    f.seek(offset)
+    values = struct.unpack(fmt, f.read(size * count))
+    f.seek(position)
+    return values
+
+
+def _decoded_pixels(f: BinaryIO) -> Iterator[bytes]:
+    """Yield the decoded pixels of any other format Pillow can read"""
+    with Image.open(f) as img:
+        yield f"{img.mode} {img.size}".encode("ascii")
+        yield img.tobytes()
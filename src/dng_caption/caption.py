@@ -1,51 +1,59 @@
 """Core caption generation functionality"""
 
-import base64
+import asyncio
+import functools
+import io
+import os
+import threading
+from collections import OrderedDict
+from contextlib import closing
 from pathlib import Path
-from typing import Optional, Dict
-import anthropic
-import openai
+from typing import Callable, Optional, Dict, Iterator, List, Tuple, Union
+import httpx
+import PIL
 from PIL import Image
+from .cache import CaptionCache
+from .providers import PROVIDERS, ClaudeAdapter, OpenAIAdapter
+from .ratelimit import RateLimiter
+
+try:
+    # SIMD base64, drop-in for the stdlib module
+    import pybase64 as base64
+except ImportError:  # optional, see the 'performance' extra
+    import base64
+
+# A path to an image file, or an image already opened with PIL
+ImageSource = Union[Path, Image.Image]
+
+# Resized JPEG bytes keyed by (path, mtime_ns, size, max_size); see
+# CaptionGenerator._encode_jpeg_bytes
+_JPEG_CACHE_SIZE = 256
+_jpeg_cache = OrderedDict()
+_jpeg_cache_lock = threading.Lock()
+
+# Keep connections to the API open between images so concurrent and
+# back-to-back requests skip the TCP/TLS handshake
+HTTP_LIMITS = httpx.Limits(
+    max_connections=32,
+    max_keepalive_connections=32,
+    keepalive_expiry=60.0
+)
+
+# Pillow-SIMD installs as PIL with a ".postN" version suffix and speeds up
+# the LANCZOS resize in _encode_jpeg without any code changes. It can't be a
+# pip extra next to the Pillow requirement, so the CLIs mention the manual
+# install when run with --verbose instead
+PILLOW_SIMD = 'post' in PIL.__version__
+PILLOW_SIMD_HINT = ("Pillow-SIMD not installed; it makes image resizing several "
+                    "times faster, see 'Optional Speedups' in the README")
 
 
 class CaptionGenerator:
     """AI-powered caption generator using Claude or OpenAI"""
 
-    CLAUDE_MODELS = {
-        'haiku': {
-            'name': 'claude-3-haiku-20240307',
-            'cost': 0.001,
-            'description': 'Fast and affordable'
-        },
-        'sonnet': {
-            'name': 'claude-3-5-sonnet-20241022',
-            'cost': 0.003,
-            'description': 'Best balance'
-        },
-        'opus': {
-            'name': 'claude-opus-4-5-20251101',
-            'cost': 0.015,
-            'description': 'Highest quality'
-        }
-    }
+    CLAUDE_MODELS = ClaudeAdapter.MODELS
 
-    OPENAI_MODELS = {
-        'gpt-4o': {
-            'name': 'gpt-4o',
-            'cost': 0.005,
-            'description': 'Latest GPT-4 with vision'
-        },
-        'gpt-4o-mini': {
-            'name': 'gpt-4o-mini',
-            'cost': 0.00015,
-            'description': 'Fast and affordable GPT-4'
-        },
-        'gpt-4-turbo': {
-            'name': 'gpt-4-turbo',
-            'cost': 0.01,
-            'description': 'Previous GPT-4 Turbo'
-        }
-    }
+    OPENAI_MODELS = OpenAIAdapter.MODELS
     
     STYLES = {
         'descriptive': "Write a 2-3 sentence professional caption for this image.",
@@ -60,42 +68,62 @@ class CaptionGenerator:
         'documentary': "Write a factual, journalistic caption.",
         'travel': "Write a travel photography caption emphasizing the location."
     }
+
+    # Approximate upper bound on image input tokens for a MAX_IMAGE_SIZE
+    # square. Both providers bill images by pixel area, not by upload size
+    IMAGE_TOKENS = 1400
+
+    # Longest edge of the image sent to the API. The vision models work at
+    # roughly this resolution, so larger uploads only cost bytes and tokens
+    MAX_IMAGE_SIZE = 1024
+
+    # Reply budget per caption
+    MAX_TOKENS = 300
+
+    # Seconds between status checks while a batch job is running
+    BATCH_POLL_INTERVAL = 30
     
-    def __init__(self, api_key: Optional[str] = None, provider: str = 'claude'):
+    def __init__(self, api_key: Optional[str] = None, provider: str = 'claude',
+                 rate_limiter: Optional[RateLimiter] = None,
+                 cache: Optional[CaptionCache] = None):
         """Initialize with API key and provider
 
         Args:
             api_key: API key for the selected provider. If not provided, will use
                     ANTHROPIC_API_KEY or OPENAI_API_KEY from environment
-            provider: Either 'claude' or 'openai' (default: 'claude')
+            provider: A key of providers.PROVIDERS, e.g. 'claude' (default)
+                     or 'openai'
+            rate_limiter: Optional limiter applied to generate_async() calls
+            cache: Optional cache of previously generated captions
         """
-        import os
         self.provider = provider.lower()
+        self.rate_limiter = rate_limiter
+        self.cache = cache
 
-        if self.provider == 'claude':
-            self.api_key = api_key or os.environ.get('ANTHROPIC_API_KEY')
-            if not self.api_key:
-                raise ValueError("Anthropic API key required (set ANTHROPIC_API_KEY)")
-            self.client = anthropic.Anthropic(api_key=self.api_key)
-            self.models = self.CLAUDE_MODELS
-        elif self.provider == 'openai':
-            self.api_key = api_key or os.environ.get('OPENAI_API_KEY')
-            if not self.api_key:
-                raise ValueError("OpenAI API key required (set OPENAI_API_KEY)")
-            self.client = openai.OpenAI(api_key=self.api_key)
-            self.models = self.OPENAI_MODELS
-        else:
-            raise ValueError(f"Invalid provider: {provider}. Must be 'claude' or 'openai'")
+        if self.provider not in PROVIDERS:
+            raise ValueError(f"Invalid provider: {provider}. Must be one of "
+                             f"{', '.join(repr(name) for name in PROVIDERS)}")
+
+        self.adapter = PROVIDERS[self.provider]
+        self.api_key = api_key or os.environ.get(self.adapter.api_key_env)
+        if not self.api_key:
+            raise ValueError(f"{self.adapter.vendor} API key required "
+                             f"(set {self.adapter.api_key_env})")
+        self.client, self.aclient = self.adapter.create_clients(self.api_key, HTTP_LIMITS)
+        self.models = self.adapter.MODELS
+        # Per instance, so subclass or instance STYLES overrides are honored
+        self._build_prompt = functools.lru_cache(maxsize=512)(self._prompt)
     
     def generate(self,
-                 image_path: Path,
+                 image_path: ImageSource,
                  style: str = 'descriptive',
                  model: Optional[str] = None,
                  location_context: Optional[str] = None) -> str:
         """Generate caption for image
 
         Args:
-            image_path: Path to image file
+            image_path: Path to image file, or an image already opened with
+                       PIL (it may be decoded at reduced size in place)
             style: Caption style (descriptive, social, minimal, etc.)
             model: Model to use. If None, uses smart defaults based on style and provider
             location_context: Optional GPS location context to include
@@ -103,106 +131,295 @@ class CaptionGenerator:
         Returns:
             Generated caption text
         """
-        # Route to provider-specific method
-        if self.provider == 'claude':
-            return self._generate_claude(image_path, style, model, location_context)
+        # Reuse an earlier caption for identical input
+        cache_key = self._cache_key(image_path, style, model, location_context)
+        if cache_key is not None:
+            if (caption := self.cache.get(cache_key)) is not None:
+                return caption
+
+        payload = self._payload(image_path, style, model, location_context)
+        response = self.adapter.create(self.client, payload)
+        caption = self.adapter.parse_response(response)
+
+        if cache_key is not None:
+            self.cache.set(cache_key, caption)
+        return caption
+
+    async def generate_async(self,
+                             image_path: ImageSource,
+                             style: str = 'descriptive',
+                             model: Optional[str] = None,
+                             location_context: Optional[str] = None,
+                             on_text: Optional[Callable[[str], None]] = None) -> str:
+        """Generate caption for image without blocking the event loop
+
+        Same arguments and return value as generate(). Image preparation runs
+        in a worker thread and the API call goes through the async client, so
+        many images can be captioned concurrently.
+
+        Args:
+            on_text: If given, the response is streamed and this is called
+                    with each chunk of caption text as it arrives
+        """
+        cache_key = await asyncio.to_thread(
+            self._cache_key, image_path, style, model, location_context
+        )
+        if cache_key is not None:
+            if (caption := self.cache.get(cache_key)) is not None:
+                if on_text is not None:
+                    on_text(caption)
+                return caption
+
+        payload = await asyncio.to_thread(
+            self._payload, image_path, style, model, location_context
+        )
+        await self._throttle(style, location_context)
+        if on_text is None:
+            response = await self.adapter.create(self.aclient, payload)
+            caption = self.adapter.parse_response(response)
         else:
-            return self._generate_openai(image_path, style, model, location_context)
-
-    def _generate_claude(self,
-                         image_path: Path,
-                         style: str,
-                         model: Optional[str],
-                         location_context: Optional[str]) -> str:
-        """Generate caption using Claude"""
-        # Use Opus model for social media captions if no model specified
-        if model is None:
-            model = 'opus' if style == 'social' else 'haiku'
+            caption = await self.adapter.stream(self.aclient, payload, on_text)
 
-        # Validate model
-        if model not in self.CLAUDE_MODELS:
-            raise ValueError(f"Invalid Claude model: {model}. Choose from {list(self.CLAUDE_MODELS.keys())}")
+        if cache_key is not None:
+            self.cache.set(cache_key, caption)
+        return caption
+
+    def generate_batch(self,
+                       items: List[Tuple[Path, Optional[str]]],
+                       style: str = 'descriptive',
+                       model: Optional[str] = None
+                       ) -> Iterator[Tuple[Path, Union[str, Exception]]]:
+        """Generate captions through the provider's batch API
+
+        Batch jobs are billed at a discount but can take minutes to hours,
+        so this suits bulk runs where latency doesn't matter. Blocks while
+        polling for completion; jobs still running are cancelled if this is
+        interrupted or closed early.
+
+        Args:
+            items: (image_path, location_context) pairs
+            style: Caption style applied to every image
+            model: Model to use. If None, uses smart defaults like generate()
+
+        Yields:
+            (image_path, caption) pairs, with an exception in place of the
+            caption for images that failed
+        """
+        # Cache hits need no request, so report them before submitting
+        todo = []
+        for i, (image_path, location_context) in enumerate(items):
+            try:
+                cache_key = self._cache_key(image_path, style, model, location_context)
+                if cache_key is not None:
+                    if (caption := self.cache.get(cache_key)) is not None:
+                        yield image_path, caption
+                        continue
+            except Exception as e:
+                yield image_path, e
+                continue
+            todo.append((i, image_path, location_context, cache_key))
+
+        if not todo:
+            return
+
+        # Payloads are built as run_batch() fills each job, so only one
+        # job's worth of base64 images is held at a time. Images that fail
+        # to encode are reported once the first job finishes.
+        todo = iter(todo)
+        failed = []
+        image_paths = {}
+        cache_keys = {}
+
+        def payloads():
+            for i, image_path, location_context, cache_key in todo:
+                try:
+                    payload = self._payload(image_path, style, model, location_context)
+                except Exception as e:
+                    failed.append((image_path, e))
+                    continue
+                # custom_id must be unique and match [a-zA-Z0-9_-]{1,64},
+                # which file names don't guarantee
+                image_paths[f"image-{i}"] = image_path
+                cache_keys[f"image-{i}"] = cache_key
+                yield f"image-{i}", payload
+
+        # Closing cancels any batch jobs still running if the caller stops
+        # iterating early
+        try:
+            with closing(self.adapter.run_batch(
+                    self.client, payloads(), self.BATCH_POLL_INTERVAL)) as results:
+                for custom_id, result in results:
+                    yield from failed
+                    failed.clear()
+                    image_path = image_paths.pop(custom_id)
+                    if isinstance(result, str) and cache_keys[custom_id] is not None:
+                        self.cache.set(cache_keys[custom_id], result)
+                    yield image_path, result
+        except Exception as e:
+            # Submitting or polling failed; jobs already running were
+            # cancelled, so nothing else is coming back
+            yield from failed
+            for image_path in image_paths.values():
+                yield image_path, e
+            for _, image_path, _, _ in todo:
+                yield image_path, e
+            return
+
+        yield from failed
+        for image_path in image_paths.values():
+            yield image_path, RuntimeError("No result returned by batch")
+
+    def _payload(self,
+                 image_path: ImageSource,
+                 style: str,
+                 model: Optional[str],
+                 location_context: Optional[str]) -> Dict:
+        """Build the provider request for an image"""
+        model_id = self._model_id(style, model)
 
         # Prepare image
         image_base64 = self._prepare_image(image_path)
 
         # Build prompt
-        prompt = self.STYLES.get(style, self.STYLES['descriptive'])
-        if location_context:
-            prompt += f"\n\n{location_context}"
+        prompt = self._build_prompt(style, location_context)
 
-        # Generate caption
-        response = self.client.messages.create(
-            model=self.CLAUDE_MODELS[model]['name'],
-            max_tokens=300,
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "image", "source": {
-                        "type": "base64",
-                        "media_type": "image/jpeg",
-                        "data": image_base64
-                    }},
-                    {"type": "text", "text": prompt}
-                ]
-            }]
+        return self.adapter.build_payload(
+            model_id, prompt, image_base64, self.MAX_TOKENS
         )
 
-        return response.content[0].text.strip()
-
-    def _generate_openai(self,
-                         image_path: Path,
-                         style: str,
-                         model: Optional[str],
-                         location_context: Optional[str]) -> str:
-        """Generate caption using OpenAI"""
-        # Use gpt-4o for social media, gpt-4o-mini for others if no model specified
+    def _model_id(self, style: str, model: Optional[str]) -> str:
+        """API model id for a model name, or the style's default model"""
+        # Fall back to the provider's default model for this style
         if model is None:
-            model = 'gpt-4o' if style == 'social' else 'gpt-4o-mini'
+            model = self.adapter.default_model(style)
 
         # Validate model
-        if model not in self.OPENAI_MODELS:
-            raise ValueError(f"Invalid OpenAI model: {model}. Choose from {list(self.OPENAI_MODELS.keys())}")
-
-        # Prepare image
-        image_base64 = self._prepare_image(image_path)
+        if model not in self.models:
+            raise ValueError(f"Invalid {self.adapter.label} model: {model}. "
+                             f"Choose from {list(self.models.keys())}")
+        return self.models[model]['name']
 
-        # Build prompt
+    def _prompt(self, style: str, location_context: Optional[str]) -> str:
+        """Caption prompt for style, with location context appended if given"""
         prompt = self.STYLES.get(style, self.STYLES['descriptive'])
         if location_context:
             prompt += f"\n\n{location_context}"
+        return prompt
+
+    def _cache_key(self,
+                   image_path: ImageSource,
+                   style: str,
+                   model: Optional[str],
+                   location_context: Optional[str]) -> Optional[Tuple]:
+        """Caption cache key for a request, or None without a cache"""
+        path = _image_path(image_path)
+        if self.cache is None or path is None:
+            return None
+        # Key on what is actually sent, so edited prompts, STYLES overrides
+        # and new default models don't return stale captions
+        return self.cache.key(path, self.provider, self._model_id(style, model),
+                              self._build_prompt(style, location_context),
+                              self._build_prompt(style, None))
 
-        # Generate caption using OpenAI Vision API
-        response = self.client.chat.completions.create(
-            model=self.OPENAI_MODELS[model]['name'],
-            max_tokens=300,
-            messages=[{
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_base64}"
-                        }
-                    },
-                    {
-                        "type": "text",
-                        "text": prompt
-                    }
-                ]
-            }]
+    async def _throttle(self, style: str, location_context: Optional[str]):
+        """Wait for rate limiter capacity before sending a request"""
+        if self.rate_limiter is None:
+            return
+
+        # Roughly 4 characters per text token, plus the reply budget
+        prompt = self._build_prompt(style, location_context)
+        await self.rate_limiter.acquire(
+            self.IMAGE_TOKENS + len(prompt) // 4 + self.MAX_TOKENS
         )
 
-        return response.choices[0].message.content.strip()
-    
-    def _prepare_image(self, image_path: Path) -> str:
+    def prefetch(self,
+                 image_path: ImageSource,
+                 style: str = 'descriptive',
+                 model: Optional[str] = None):
+        """Resize and encode image ahead of generation
+
+        Lets callers overlap image encoding with other work, such as GPS
+        lookup; the next generate call for the same file reuses the result.
+        Skipped when a caption for this image, style and model is already
+        cached, since generation would then never need the encoded image.
+        """
+        path = _image_path(image_path)
+        if self.cache is not None and path is not None:
+            if self.cache.contains(path, self.provider,
+                                   self._model_id(style, model),
+                                   self._build_prompt(style, None)):
+                return
+        self._encode_jpeg_bytes(image_path)
+
+    def _prepare_image(self, image_path: ImageSource) -> str:
         """Prepare image for API"""
-        img = Image.open(image_path)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        img.thumbnail((1600, 1600), Image.Resampling.LANCZOS)
+        return base64.b64encode(self._encode_jpeg_bytes(image_path)).decode('utf-8')
+
+    def _encode_jpeg_bytes(self, image_path: ImageSource) -> bytes:
+        """Resized JPEG bytes for image, reused until the file changes"""
+        path = _image_path(image_path)
+        if path is None:
+            # In-memory image, nothing to key a cache entry on
+            return _encode_jpeg(image_path, self.MAX_IMAGE_SIZE)
+        
+        stat = path.stat()
+        key = (str(path), stat.st_mtime_ns, stat.st_size, self.MAX_IMAGE_SIZE)
+        with _jpeg_cache_lock:
+            if key in _jpeg_cache:
+                _jpeg_cache.move_to_end(key)
+                return _jpeg_cache[key]
+        
+        # Encode outside the lock so other images aren't held up
+        if isinstance(image_path, Image.Image):
+            jpeg_bytes = _encode_jpeg(image_path, self.MAX_IMAGE_SIZE)
+        else:
+            with Image.open(path) as img:
+                jpeg_bytes = _encode_jpeg(img, self.MAX_IMAGE_SIZE)
         
-        import io
-        buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=85)
-        return base64.b64encode(buffer.getvalue()).decode('utf-8')
+        with _jpeg_cache_lock:
+            _jpeg_cache[key] = jpeg_bytes
+            if len(_jpeg_cache) > _JPEG_CACHE_SIZE:
+                _jpeg_cache.popitem(last=False)
+        return jpeg_bytes
+
+
+def _image_path(image: ImageSource) -> Optional[Path]:
+    """Resolved file path behind an image source, if it has one"""
+    if isinstance(image, Image.Image):
+        filename = getattr(image, 'filename', None)
+        return Path(filename).resolve() if filename else None
+    return Path(image).resolve()
+
+
+def _encode_jpeg(source: Image.Image, max_size: int) -> bytes:
+    """Downscale image to fit max_size and encode it as JPEG
+
+    A JPEG source that hasn't been loaded yet is switched to reduced-size
+    decoding in place; its pixels are otherwise left untouched.
+    """
+    size = (max_size, max_size)
+    img = source
+    if img.format == 'JPEG':
+        # Let libjpeg decode at a reduced DCT scale close to the target
+        # size instead of decoding every pixel of the full image
+        img.draft('RGB', size)
+    
+    # Box-filter down by an integer factor while still well above the
+    # target. thumbnail() does this internally too, but only after convert()
+    # has already processed every full-resolution pixel. Palette and
+    # bilevel modes can't be averaged, so those are left to thumbnail()
+    factor = max(1, min(img.width // (2 * max_size), img.height // (2 * max_size)))
+    if factor > 1 and img.mode in ('L', 'LA', 'RGB', 'RGBA', 'CMYK'):
+        img = img.reduce(factor)
+    
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if img is source:
+        # thumbnail() resizes in place; don't shrink the caller's image
+        img = img.copy()
+    img.thumbnail(size, Image.Resampling.LANCZOS)
+    
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=80, subsampling='4:2:0',
+             optimize=True, progressive=True)
+    return buffer.getvalue()
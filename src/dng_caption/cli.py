@@ -1,11 +1,20 @@
 """Command-line interface"""
 
 import sys
+import logging
 import argparse
+import asyncio
+from contextlib import closing
 from pathlib import Path
-from .caption import CaptionGenerator
+from PIL import Image
+from .cache import CaptionCache
+from .caption import PILLOW_SIMD, PILLOW_SIMD_HINT, CaptionGenerator
 from .gps import GPSExtractor
+from .providers import PROVIDERS
 from .embed import XMPEmbedder
+from .ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
 
 
 def main():
@@ -15,7 +24,7 @@ def main():
     )
     parser.add_argument('images', nargs='+', help='Images to process')
     parser.add_argument('--provider', default='claude',
-                       choices=['claude', 'openai'],
+                       choices=list(PROVIDERS),
                        help='AI provider to use (default: claude)')
     parser.add_argument('--model',
                        help='Model to use. Claude: haiku, sonnet, opus. OpenAI: gpt-4o, gpt-4o-mini, gpt-4-turbo')
@@ -26,46 +35,196 @@ def main():
                        help='Disable GPS extraction')
     parser.add_argument('--embed', action='store_true',
                        help='Embed captions into JPEG files')
+    parser.add_argument('--concurrency', type=int, default=10, metavar='N',
+                       help='Maximum number of images processed at once (default: 10)')
+    parser.add_argument('--rpm', type=int, default=50,
+                       help='Maximum API requests per minute (default: 50)')
+    parser.add_argument('--tpm', type=int, default=40000,
+                       help='Maximum API tokens per minute (default: 40000)')
+    parser.add_argument('--batch', action='store_true',
+                       help='Submit all images as one discounted batch job and wait for it')
+    parser.add_argument('--stream', action='store_true',
+                       help='Print captions as they are generated, in input order')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Always request new captions instead of reusing cached ones')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                       help='Show informational messages')
 
     args = parser.parse_args()
+    if args.rpm < 1 or args.tpm < 1:
+        parser.error('--rpm and --tpm must be at least 1')
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(message)s'
+    )
+    if not PILLOW_SIMD:
+        logger.info(PILLOW_SIMD_HINT)
 
     # Initialize components
-    generator = CaptionGenerator(provider=args.provider)
+    generator = CaptionGenerator(
+        provider=args.provider,
+        rate_limiter=RateLimiter(rpm=args.rpm, tpm=args.tpm),
+        cache=CaptionCache() if not args.no_cache else None
+    )
     gps_extractor = GPSExtractor() if not args.no_gps else None
     embedder = XMPEmbedder() if args.embed else None
     
     # Process images
+    if args.batch:
+        _process_batch(args, generator, gps_extractor, embedder)
+    else:
+        asyncio.run(_process_images(args, generator, gps_extractor, embedder))
+    
+    return 0
+
+
+async def _process_images(args, generator, gps_extractor, embedder):
+    """Caption all images concurrently, at most args.concurrency at a time"""
+    sem = asyncio.Semaphore(max(1, args.concurrency))
+    printer = _StreamPrinter(len(args.images)) if args.stream else None
+
+    async def process_one(index, image_path):
+        path = Path(image_path)
+        if not path.exists():
+            if printer:
+                printer.fail(index, f"File not found: {path}")
+            else:
+                print(f"File not found: {path}")
+            return
+        
+        async with sem:
+            try:
+                # Open once; GPS and caption prep both work from this image.
+                # Pixels aren't loaded here so JPEGs can still be decoded
+                # at reduced size
+                with await asyncio.to_thread(Image.open, path) as img:
+                    # Extract GPS if enabled. The EXIF header was read by
+                    # open(), so only geocoding overlaps image encoding
+                    location_context = None
+                    if gps_extractor:
+                        gps_data = gps_extractor.extract_gps(img)
+                        location_context, _ = await asyncio.gather(
+                            asyncio.to_thread(_location_context, gps_extractor, gps_data),
+                            asyncio.to_thread(generator.prefetch, img,
+                                              args.style, args.model)
+                        )
+                    
+                    # Generate caption
+                    if printer:
+                        printer.write(index, f"{path.name}: ")
+                        caption = await generator.generate_async(
+                            img, args.style, args.model, location_context,
+                            on_text=lambda text: printer.write(index, text)
+                        )
+                    else:
+                        caption = await generator.generate_async(
+                            img, args.style, args.model, location_context
+                        )
+                        print(f"✓ {path.name}: {caption[:50]}...")
+                
+                # Embed if requested
+                if embedder:
+                    await asyncio.to_thread(embedder.embed, path, caption)
+                
+                # Only now, so an embedding error still prints in order
+                if printer:
+                    printer.finish(index)
+                    
+            except Exception as e:
+                if printer:
+                    printer.fail(index, f"✗ {path.name}: {e}")
+                else:
+                    print(f"✗ {path.name}: {e}")
+
+    tasks = [process_one(i, p) for i, p in enumerate(args.images)]
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _process_batch(args, generator, gps_extractor, embedder):
+    """Caption all images through a single provider batch job"""
+    items = []
     for image_path in args.images:
         path = Path(image_path)
         if not path.exists():
             print(f"File not found: {path}")
             continue
         
-        try:
-            # Extract GPS if enabled
-            location_context = None
-            if gps_extractor:
-                if gps_data := gps_extractor.extract_gps(path):
-                    if location := gps_extractor.reverse_geocode(
-                        gps_data['latitude'], gps_data['longitude']
-                    ):
-                        location_context = f"Location: {location['formatted']}"
-            
-            # Generate caption
-            caption = generator.generate(
-                path, args.style, args.model, location_context
+        location_context = None
+        if gps_extractor:
+            location_context = _location_context(
+                gps_extractor, gps_extractor.extract_gps(path)
             )
+        items.append((path, location_context))
+    
+    if not items:
+        return
+    
+    print(f"Submitting batch of {len(items)} images, waiting for results...")
+    # Closing on Ctrl-C cancels the remote batch jobs still running
+    with closing(generator.generate_batch(items, args.style, args.model)) as results:
+        for path, result in results:
+            if isinstance(result, Exception):
+                print(f"✗ {path.name}: {result}")
+                continue
             
-            print(f"✓ {path.name}: {caption[:50]}...")
+            print(f"✓ {path.name}: {result[:50]}...")
             
             # Embed if requested
             if embedder:
-                embedder.embed(path, caption)
-                
-        except Exception as e:
-            print(f"✗ {path.name}: {e}")
-    
-    return 0
+                try:
+                    embedder.embed(path, result)
+                except Exception as e:
+                    print(f"✗ {path.name}: {e}")
+
+
+class _StreamPrinter:
+    """Print streamed captions in input order without interleaving
+
+    The first unfinished image streams straight to the terminal; output for
+    images further down the list is buffered and flushed once every image
+    before it is done.
+    """
+
+    def __init__(self, count):
+        self.buffers = [[] for _ in range(count)]
+        self.done = [False] * count
+        self.started = [False] * count
+        self.head = 0
+
+    def write(self, index, text):
+        """Output text for image index, buffering it unless it's at the head"""
+        self.started[index] = True
+        if index == self.head:
+            print(text, end='', flush=True)
+        else:
+            self.buffers[index].append(text)
+
+    def finish(self, index):
+        """End image index's output and flush any images now at the head"""
+        self.write(index, "\n")
+        self.done[index] = True
+        while self.head < len(self.done) and self.done[self.head]:
+            self.head += 1
+            if self.head < len(self.done):
+                print(''.join(self.buffers[self.head]), end='', flush=True)
+                self.buffers[self.head] = []
+
+    def fail(self, index, message):
+        """End image index's output with an error message"""
+        # Start a fresh line if part of a caption was already written
+        self.write(index, f"\n{message}" if self.started[index] else message)
+        self.finish(index)
+
+
+def _location_context(gps_extractor, gps_data):
+    """Build the prompt location line from extracted GPS data, if any"""
+    if gps_data:
+        if location := gps_extractor.reverse_geocode(
+            gps_data['latitude'], gps_data['longitude']
+        ):
+            return f"Location: {location['formatted']}"
+    return None
 
 
 if __name__ == '__main__':
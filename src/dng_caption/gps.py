@@ -1,73 +1,264 @@
 """GPS extraction and geocoding functionality"""
 
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple, Union
 from pathlib import Path
-import piexif
-from PIL import Image
+import functools
+import threading
+import exifread
+from diskcache import Cache
+from PIL import ExifTags, Image
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+from geopy.extra.rate_limiter import RateLimiter
 import time
 
+try:
+    import numpy as np
+except ImportError:  # optional, see the 'performance' extra
+    np = None
+
+GEOCODE_CACHE_DIR = Path('~/.cache/dng-caption/geocode').expanduser()
+
+# Leading bytes of JPEG and TIFF (little/big endian) files
+_EXIFREAD_MAGIC = (b'\xff\xd8', b'II', b'MM')
+
 
 class GPSExtractor:
     """Extract and geocode GPS data from images"""
     
-    def __init__(self):
+    def __init__(self, cache_dir: Optional[Path] = GEOCODE_CACHE_DIR):
+        """Initialize geocoder
+
+        Args:
+            cache_dir: Directory for the persistent reverse-geocode cache,
+                      or None to only cache in memory
+        """
         self.geolocator = Nominatim(user_agent="dng_caption_tool")
+        # Nominatim's usage policy allows at most one request per second;
+        # retries are handled in _reverse_lookup
+        self._reverse = RateLimiter(
+            self.geolocator.reverse,
+            min_delay_seconds=1,
+            max_retries=0,
+            swallow_exceptions=False
+        )
+        # Callers may come from several threads at once (see cli.py)
+        self._request_lock = threading.Lock()
+        self._key_locks = {}
+        self._key_locks_lock = threading.Lock()
+        self.cache = Cache(str(cache_dir)) if cache_dir else None
+        self._reverse_cached = functools.lru_cache(maxsize=4096)(
+            self._reverse_lookup
+        )
     
-    def extract_gps(self, image_path: Path) -> Optional[Dict]:
-        """Extract GPS coordinates from image"""
+    def extract_gps(self, image_path: Union[Path, Image.Image]) -> Optional[Dict]:
+        """Extract GPS coordinates from image
+
+        Accepts a path or an image already opened with PIL; the latter
+        reuses the EXIF data Pillow read when opening it.
+        """
         try:
-            img = Image.open(image_path)
-            if 'exif' not in img.info:
-                return None
-            
-            exif_dict = piexif.load(img.info['exif'])
-            if piexif.GPSIFD.GPSLatitude not in exif_dict.get('GPS', {}):
-                return None
-            
-            # Extract coordinates
-            lat = self._convert_to_degrees(
-                exif_dict['GPS'][piexif.GPSIFD.GPSLatitude],
-                exif_dict['GPS'][piexif.GPSIFD.GPSLatitudeRef].decode('utf-8')
-            )
-            
-            lon = self._convert_to_degrees(
-                exif_dict['GPS'][piexif.GPSIFD.GPSLongitude],
-                exif_dict['GPS'][piexif.GPSIFD.GPSLongitudeRef].decode('utf-8')
-            )
+            return self._gps_result(self._read_gps(image_path))
+        except Exception:
+            return None
+    
+    def extract_gps_batch(self, image_paths: List[Union[Path, Image.Image]]
+                          ) -> List[Optional[Dict]]:
+        """Extract GPS coordinates from many images
+
+        Same results as calling extract_gps() on each path, but with numpy
+        installed the degree/minute/second conversion for all images is
+        done in a single vectorized pass.
+        """
+        raws = []
+        for image_path in image_paths:
+            try:
+                raws.append(self._read_gps(image_path))
+            except Exception:
+                raws.append(None)
+        
+        if np is None:
+            results = []
+            for raw in raws:
+                try:
+                    results.append(self._gps_result(raw))
+                except ZeroDivisionError:
+                    results.append(None)
+            return results
+        
+        results = [None] * len(raws)
+        valid = [i for i, raw in enumerate(raws) if raw is not None]
+        if not valid:
+            return results
+        
+        # (N, 6, 2) rationals: latitude then longitude, each as d/m/s
+        rationals = np.array(
+            [raws[i][0] + raws[i][2] for i in valid], dtype=np.int64
+        )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dms = (rationals[:, :, 0] / rationals[:, :, 1]).reshape(-1, 2, 3)
+        coords = dms[:, :, 0] + dms[:, :, 1] / 60.0 + dms[:, :, 2] / 3600.0
+        
+        refs = np.array([(raws[i][1], raws[i][3]) for i in valid])
+        coords = np.where(np.isin(refs, ['S', 'W']), -coords, coords)
+        
+        for (lat, lon), i in zip(coords.tolist(), valid):
+            # Zero denominators fail the image, as in extract_gps()
+            if not (np.isfinite(lat) and np.isfinite(lon)):
+                continue
             
             result = {'latitude': lat, 'longitude': lon}
             
-            # Extract altitude if available
-            if piexif.GPSIFD.GPSAltitude in exif_dict.get('GPS', {}):
-                alt = exif_dict['GPS'][piexif.GPSIFD.GPSAltitude]
-                result['altitude'] = alt[0] / alt[1]
+            if (altitude := raws[i][4]) is not None:
+                if altitude[1] == 0:
+                    continue
+                result['altitude'] = altitude[0] / altitude[1]
             
-            return result
+            results[i] = result
+        
+        return results
+    
+    def _gps_result(self, raw: Optional[Tuple]) -> Optional[Dict]:
+        """Convert raw GPS tags from _read_gps() to decimal degrees"""
+        if raw is None:
+            return None
+        
+        lat_value, lat_ref, lon_value, lon_ref, altitude = raw
+        
+        # Extract coordinates
+        result = {
+            'latitude': self._convert_to_degrees(lat_value, lat_ref),
+            'longitude': self._convert_to_degrees(lon_value, lon_ref)
+        }
+        
+        # Extract altitude if available
+        if altitude is not None:
+            result['altitude'] = altitude[0] / altitude[1]
+        
+        return result
+    
+    def _read_gps(self, image_path: Union[Path, Image.Image]) -> Optional[Tuple]:
+        """Read raw GPS tags from image
+
+        Returns (latitude, latitude_ref, longitude, longitude_ref, altitude),
+        with coordinates as three (numerator, denominator) pairs and altitude
+        as one pair or None, or None if the image has no GPS position.
+        """
+        if isinstance(image_path, Image.Image):
+            return self._read_gps_pillow(image_path)
+        
+        with open(image_path, 'rb') as f:
+            # exifread only reads JPEG and TIFF-based files (DNG included)
+            # quietly; on other formats it prints warnings to stderr, so
+            # leave those to Pillow
+            magic = f.read(2)
+            f.seek(0)
+            if magic not in _EXIFREAD_MAGIC:
+                with Image.open(f) as img:
+                    return self._read_gps_pillow(img)
             
-        except Exception:
+            # stop_tag ends the walk of the GPS IFD at the altitude tag;
+            # the other IFDs are still read, but details=False skips
+            # MakerNotes and thumbnails and no raw image data is touched
+            tags = exifread.process_file(f, stop_tag='GPSAltitude', details=False)
+        
+        # A JPEG or TIFF without EXIF has nothing for Pillow to find either
+        if 'GPS GPSLatitude' not in tags:
+            return None
+        
+        latitude = self._rationals(tags['GPS GPSLatitude'].values)
+        longitude = self._rationals(tags['GPS GPSLongitude'].values)
+        if len(latitude) != 3 or len(longitude) != 3:
+            return None
+        
+        altitude = None
+        if 'GPS GPSAltitude' in tags:
+            altitude = self._rationals(tags['GPS GPSAltitude'].values)[0]
+        
+        return (
+            latitude,
+            tags['GPS GPSLatitudeRef'].values,
+            longitude,
+            tags['GPS GPSLongitudeRef'].values,
+            altitude
+        )
+    
+    def _read_gps_pillow(self, img: Image.Image) -> Optional[Tuple]:
+        """Read raw GPS tags through Pillow, same result as _read_gps()"""
+        gps = img.getexif().get_ifd(ExifTags.IFD.GPSInfo)
+        if not gps or ExifTags.GPS.GPSLatitude not in gps:
             return None
+        
+        latitude = self._rationals(gps[ExifTags.GPS.GPSLatitude])
+        longitude = self._rationals(gps[ExifTags.GPS.GPSLongitude])
+        if len(latitude) != 3 or len(longitude) != 3:
+            return None
+        
+        altitude = None
+        if ExifTags.GPS.GPSAltitude in gps:
+            altitude = self._rationals([gps[ExifTags.GPS.GPSAltitude]])[0]
+        
+        return (
+            latitude,
+            gps[ExifTags.GPS.GPSLatitudeRef],
+            longitude,
+            gps[ExifTags.GPS.GPSLongitudeRef],
+            altitude
+        )
+    
+    def _rationals(self, values) -> Tuple:
+        """Normalize EXIF rationals to (numerator, denominator) int pairs"""
+        return tuple((int(v.numerator), int(v.denominator)) for v in values)
     
     def reverse_geocode(self, latitude: float, longitude: float, 
                         retries: int = 2) -> Optional[Dict]:
-        """Convert coordinates to location name"""
+        """Convert coordinates to location name
+
+        Coordinates are rounded to 3 decimals (~100 m) so photos taken at
+        the same spot share a single cached lookup. Concurrent calls for the
+        same rounded spot wait for the first one instead of repeating it.
+        """
+        key = (round(latitude, 3), round(longitude, 3))
+        with self._key_locks_lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        
+        try:
+            with key_lock:
+                return self._reverse_cached(*key, retries)
+        except LookupError:
+            return None
+    
+    def _reverse_lookup(self, latitude: float, longitude: float,
+                        retries: int) -> Dict:
+        """Query Nominatim, consulting the disk cache first
+
+        Raises LookupError on failure so that misses are never cached.
+        """
+        key = (latitude, longitude)
+        if self.cache is not None:
+            if (cached := self.cache.get(key)) is not None:
+                return cached
+        
         for attempt in range(retries):
             try:
-                location = self.geolocator.reverse(
-                    f"{latitude}, {longitude}",
-                    timeout=5,
-                    language='en'
-                )
+                with self._request_lock:
+                    location = self._reverse(
+                        f"{latitude}, {longitude}",
+                        timeout=5,
+                        language='en'
+                    )
                 
                 if location:
-                    return self._parse_location(location)
+                    result = self._parse_location(location)
+                    if self.cache is not None:
+                        self.cache.set(key, result)
+                    return result
                     
             except (GeocoderTimedOut, GeocoderServiceError):
                 if attempt < retries - 1:
                     time.sleep(1)
                     
-        return None
+        raise LookupError(f"No location found for {latitude}, {longitude}")
     
     def _convert_to_degrees(self, value, ref):
         """Convert GPS coordinates to decimal degrees"""
@@ -0,0 +1,428 @@
+"""Provider adapters for the caption APIs
+
+Each adapter knows one provider's models, client setup, request payload and
+response shape, so CaptionGenerator can drive any of them the same way.
+"""
+
+import json
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, Iterator, Tuple, Union
+import anthropic
+import httpx
+import openai
+
+
+class ProviderAdapter(ABC):
+    """Interface CaptionGenerator uses to talk to a provider
+
+    A new provider subclasses this, fills in every abstract member (class
+    attributes satisfy the abstract properties) and registers an instance
+    in PROVIDERS. Batch splitting and cancellation are shared; subclasses
+    only submit, poll, read and cancel a single batch job.
+    """
+
+    @property
+    @abstractmethod
+    def label(self) -> str:
+        """Short name used in messages, e.g. 'Claude'"""
+
+    @property
+    @abstractmethod
+    def vendor(self) -> str:
+        """Company name used in messages, e.g. 'Anthropic'"""
+
+    @property
+    @abstractmethod
+    def api_key_env(self) -> str:
+        """Environment variable holding the API key"""
+
+    @property
+    @abstractmethod
+    def MODELS(self) -> Dict[str, Dict]:
+        """Model names mapped to {'name': API model id, 'cost', 'description'}"""
+
+    @property
+    @abstractmethod
+    def BATCH_MAX_BYTES(self) -> int:
+        """Serialized request size allowed per batch job"""
+
+    @property
+    @abstractmethod
+    def BATCH_MAX_REQUESTS(self) -> int:
+        """Number of requests allowed per batch job"""
+
+    @abstractmethod
+    def default_model(self, style: str) -> str:
+        """Model name to use for a caption style"""
+
+    @abstractmethod
+    def create_clients(self, api_key: str, limits: httpx.Limits) -> Tuple:
+        """Build (sync, async) API clients"""
+
+    @abstractmethod
+    def build_payload(
+        self, model: str, prompt: str, image_base64: str, max_tokens: int
+    ) -> Dict:
+        """Build request arguments for an image and prompt"""
+
+    @abstractmethod
+    def create(self, client, payload: Dict):
+        """Send a request; returns an awaitable for async clients"""
+
+    @abstractmethod
+    def parse_response(self, response) -> str:
+        """Extract caption text from a response"""
+
+    @abstractmethod
+    async def stream(
+        self, aclient, payload: Dict, on_text: Callable[[str], None]
+    ) -> str:
+        """Stream a response, returning the full caption"""
+
+    def run_batch(
+        self, client, payloads: Iterable[Tuple[str, Dict]], poll_interval: float
+    ) -> Iterator[Tuple[str, Union[str, Exception]]]:
+        """Run (custom_id, payload) pairs through the provider's batch API
+
+        Payloads are split into as many batch jobs as the provider's limits
+        require. All jobs are submitted up front so they run side by side;
+        payloads are consumed one job at a time, so a lazy iterable only
+        keeps a single job's worth in memory.
+        Jobs that haven't finished are cancelled if the caller is
+        interrupted (e.g. Ctrl-C while polling) or stops iterating.
+
+        Yields (custom_id, caption or exception) as each job finishes.
+        """
+        pending = []
+        try:
+            for chunk in self._chunk_payloads(payloads):
+                pending.append(self._submit_batch(client, chunk))
+            while pending:
+                batch = self._wait_batch(client, pending[0], poll_interval)
+                pending.pop(0)
+                yield from self._batch_results(client, batch)
+        finally:
+            for batch_id in pending:
+                try:
+                    self._cancel_batch(client, batch_id)
+                except Exception:
+                    pass
+
+    def _chunk_payloads(
+        self, payloads: Iterable[Tuple[str, Dict]]
+    ) -> Iterator[Dict[str, Dict]]:
+        """Split payloads into batches within BATCH_MAX_BYTES/REQUESTS"""
+        chunk = {}
+        size = 0
+        for custom_id, payload in payloads:
+            # Request envelopes add a little on top of the payload itself
+            payload_size = len(json.dumps(payload)) + 256
+            if chunk and (
+                size + payload_size > self.BATCH_MAX_BYTES
+                or len(chunk) >= self.BATCH_MAX_REQUESTS
+            ):
+                yield chunk
+                chunk = {}
+                size = 0
+            chunk[custom_id] = payload
+            size += payload_size
+        if chunk:
+            yield chunk
+
+    @abstractmethod
+    def _submit_batch(self, client, payloads: Dict[str, Dict]) -> str:
+        """Start a batch job, returning its id"""
+
+    @abstractmethod
+    def _wait_batch(self, client, batch_id: str, poll_interval: float):
+        """Poll a batch job until it stops running, returning it"""
+
+    @abstractmethod
+    def _batch_results(
+        self, client, batch
+    ) -> Iterator[Tuple[str, Union[str, Exception]]]:
+        """Yield (custom_id, caption or exception) for a finished job"""
+
+    @abstractmethod
+    def _cancel_batch(self, client, batch_id: str):
+        """Cancel a batch job"""
+
+
+class ClaudeAdapter(ProviderAdapter):
+    """Anthropic Messages API"""
+
+    label = "Claude"
+    vendor = "Anthropic"
+    api_key_env = "ANTHROPIC_API_KEY"
+
+    # API limits are 256 MB and 100,000 requests per Message Batch
+    BATCH_MAX_BYTES = 200 * 1024 * 1024
+    BATCH_MAX_REQUESTS = 100000
+
+    MODELS = {
+        "haiku": {
+            "name": "claude-3-haiku-20240307",
+            "cost": 0.001,
+            "description": "Fast and affordable",
+        },
+        "sonnet": {
+            "name": "claude-3-5-sonnet-20241022",
+            "cost": 0.003,
+            "description": "Best balance",
+        },
+        "opus": {
+            "name": "claude-opus-4-5-20251101",
+            "cost": 0.015,
+            "description": "Highest quality",
+        },
+    }
+
+    def default_model(self, style: str) -> str:
+        """Use Opus for social media captions, Haiku otherwise"""
+        return "opus" if style == "social" else "haiku"
+
+    def create_clients(self, api_key: str, limits: httpx.Limits) -> Tuple:
+        """Build (sync, async) API clients"""
+        return (
+            anthropic.Anthropic(
+                api_key=api_key,
+                http_client=anthropic.DefaultHttpxClient(limits=limits, http2=True),
+            ),
+            anthropic.AsyncAnthropic(
+                api_key=api_key,
+                http_client=anthropic.DefaultAsyncHttpxClient(
+                    limits=limits, http2=True
+                ),
+            ),
+        )
+
+    def build_payload(
+        self, model: str, prompt: str, image_base64: str, max_tokens: int
+    ) -> Dict:
+        """Build messages.create() arguments"""
+        return {
+            "model": model,
+            "max_tokens": max_tokens,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": "image/jpeg",
+                                "data": image_base64,
+                            },
+                        },
+                        {"type": "text", "text": prompt},
+                    ],
+                }
+            ],
+        }
+
+    def create(self, client, payload: Dict):
+        """Send a request; returns an awaitable for async clients"""
+        return client.messages.create(**payload)
+
+    def parse_response(self, response) -> str:
+        """Extract caption text from a response"""
+        return response.content[0].text.strip()
+
+    async def stream(
+        self, aclient, payload: Dict, on_text: Callable[[str], None]
+    ) -> str:
+        """Stream a response, returning the full caption"""
+        async with aclient.messages.stream(**payload) as stream:
+            async for text in stream.text_stream:
+                on_text(text)
+            message = await stream.get_final_message()
+        return self.parse_response(message)
+
+    def _submit_batch(self, client, payloads: Dict[str, Dict]) -> str:
+        """Create a Message Batch"""
+        batch = client.messages.batches.create(
+            requests=[
+                {"custom_id": custom_id, "params": payload}
+                for custom_id, payload in payloads.items()
+            ]
+        )
+        return batch.id
+
+    def _wait_batch(self, client, batch_id: str, poll_interval: float):
+        """Poll until the batch has ended"""
+        batch = client.messages.batches.retrieve(batch_id)
+        while batch.processing_status != "ended":
+            time.sleep(poll_interval)
+            batch = client.messages.batches.retrieve(batch_id)
+        return batch
+
+    def _batch_results(
+        self, client, batch
+    ) -> Iterator[Tuple[str, Union[str, Exception]]]:
+        """Read results of an ended batch"""
+        for entry in client.messages.batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                yield entry.custom_id, self.parse_response(entry.result.message)
+            else:
+                yield entry.custom_id, RuntimeError(
+                    f"Batch request {entry.result.type}"
+                )
+
+    def _cancel_batch(self, client, batch_id: str):
+        """Cancel a Message Batch"""
+        client.messages.batches.cancel(batch_id)
+
+
+class OpenAIAdapter(ProviderAdapter):
+    """OpenAI Chat Completions API"""
+
+    label = "OpenAI"
+    vendor = "OpenAI"
+    api_key_env = "OPENAI_API_KEY"
+
+    # API limits are 200 MB and 50,000 requests per batch input file
+    BATCH_MAX_BYTES = 180 * 1024 * 1024
+    BATCH_MAX_REQUESTS = 50000
+
+    MODELS = {
+        "gpt-4o": {
+            "name": "gpt-4o",
+            "cost": 0.005,
+            "description": "Latest GPT-4 with vision",
+        },
+        "gpt-4o-mini": {
+            "name": "gpt-4o-mini",
+            "cost": 0.00015,
+            "description": "Fast and affordable GPT-4",
+        },
+        "gpt-4-turbo": {
+            "name": "gpt-4-turbo",
+            "cost": 0.01,
+            "description": "Previous GPT-4 Turbo",
+        },
+    }
+
+    def default_model(self, style: str) -> str:
+        """Use gpt-4o for social media, gpt-4o-mini otherwise"""
+        return "gpt-4o" if style == "social" else "gpt-4o-mini"
+
+    def create_clients(self, api_key: str, limits: httpx.Limits) -> Tuple:
+        """Build (sync, async) API clients"""
+        return (
+            openai.OpenAI(
+                api_key=api_key,
+                http_client=openai.DefaultHttpxClient(limits=limits, http2=True),
+            ),
+            openai.AsyncOpenAI(
+                api_key=api_key,
+                http_client=openai.DefaultAsyncHttpxClient(limits=limits, http2=True),
+            ),
+        )
+
+    def build_payload(
+        self, model: str, prompt: str, image_base64: str, max_tokens: int
+    ) -> Dict:
+        """Build chat.completions.create() arguments for the Vision API"""
+        return {
+            "model": model,
+            "max_tokens": max_tokens,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{image_base64}"
+                            },
+                        },
+                        {"type": "text", "text": prompt},
+                    ],
+                }
+            ],
+        }
+
+    def create(self, client, payload: Dict):
+        """Send a request; returns an awaitable for async clients"""
+        return client.chat.completions.create(**payload)
+
+    def parse_response(self, response) -> str:
+        """Extract caption text from a response"""
+        return response.choices[0].message.content.strip()
+
+    async def stream(
+        self, aclient, payload: Dict, on_text: Callable[[str], None]
+    ) -> str:
+        """Stream a response, returning the full caption"""
+        parts = []
+        stream = await aclient.chat.completions.create(**payload, stream=True)
+        async for chunk in stream:
+            if chunk.choices and (text := chunk.choices[0].delta.content):
+                on_text(text)
+                parts.append(text)
+        return "".join(parts).strip()
+
+    def _submit_batch(self, client, payloads: Dict[str, Dict]) -> str:
+        """Upload payloads as a JSONL input file and start a batch on it"""
+        lines = [
+            json.dumps(
+                {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": payload,
+                }
+            )
+            for custom_id, payload in payloads.items()
+        ]
+        input_file = client.files.create(
+            file=("captions.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def _wait_batch(self, client, batch_id: str, poll_interval: float):
+        """Poll until the batch has finished, one way or another"""
+        batch = client.batches.retrieve(batch_id)
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(poll_interval)
+            batch = client.batches.retrieve(batch_id)
+        return batch
+
+    def _batch_results(
+        self, client, batch
+    ) -> Iterator[Tuple[str, Union[str, Exception]]]:
+        """Read the output and error files of a finished batch"""
+        # Expired or cancelled batches can still carry partial results
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if not record.get("error") and response.get("status_code") == 200:
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    yield record["custom_id"], content.strip()
+                else:
+                    error = record.get("error") or response.get("body", {}).get("error")
+                    yield record["custom_id"], RuntimeError(
+                        f"Batch request failed: {error}"
+                    )
+
+    def _cancel_batch(self, client, batch_id: str):
+        """Cancel a batch"""
+        client.batches.cancel(batch_id)
+
+
+PROVIDERS = {
+    "claude": ClaudeAdapter(),
+    "openai": OpenAIAdapter(),
+}
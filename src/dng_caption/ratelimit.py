@@ -0,0 +1,61 @@
+"""Client-side rate limiting for API calls"""
+
+import asyncio
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """Throttle requests to stay under requests/min and tokens/min limits
+
+    Keeps a sliding 60 second window of (timestamp, tokens) reservations and
+    makes callers wait until a new request fits, instead of letting the API
+    reject it with a 429 and backing off.
+    """
+
+    WINDOW = 60.0
+
+    def __init__(self, rpm: int = 50, tpm: int = 40000):
+        """Initialize limiter
+
+        Args:
+            rpm: Maximum requests per minute
+            tpm: Maximum (estimated) tokens per minute
+        """
+        if rpm < 1 or tpm < 1:
+            raise ValueError("rpm and tpm must be positive")
+        self.rpm = rpm
+        self.tpm = tpm
+        self._window = deque()
+        self._tokens = 0
+        # Created on first use so it binds to the running event loop
+        self._lock = None
+
+    async def acquire(self, tokens: int):
+        """Wait until a request costing `tokens` fits in the window"""
+        # A single request larger than the whole budget waits for an empty
+        # window rather than forever
+        tokens = min(tokens, self.tpm)
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # Holding the lock while sleeping keeps callers in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._evict(now)
+
+                if len(self._window) < self.rpm and self._tokens + tokens <= self.tpm:
+                    self._window.append((now, tokens))
+                    self._tokens += tokens
+                    return
+
+                # Sleep until the oldest reservation leaves the window
+                await asyncio.sleep(self._window[0][0] + self.WINDOW - now)
+
+    def _evict(self, now: float):
+        """Drop reservations older than the window"""
+        while self._window and now - self._window[0][0] >= self.WINDOW:
+            _, tokens = self._window.popleft()
+            self._tokens -= tokens
@@ -0,0 +1,150 @@
+"""Tests for the persistent caption cache"""
+
+import os
+import shutil
+
+import pytest
+from PIL import Image
+
+from dng_caption.cache import CaptionCache
+from dng_caption.caption import CaptionGenerator
+
+PROMPT = "Write a brief one-sentence caption."
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return CaptionCache(tmp_path / 'cache')
+
+
+def write_image(path, color='gray', **save_args):
+    """Save a small image with a couple of distinct pixels"""
+    img = Image.new('RGB', (64, 48), color)
+    img.putpixel((3, 4), (255, 0, 0))
+    img.save(path, **save_args)
+    return path
+
+
+@pytest.fixture
+def image(tmp_path):
+    return write_image(tmp_path / 'photo.jpg')
+
+
+def key(cache, path, **overrides):
+    settings = {
+        'provider': 'claude',
+        'model': 'claude-3-haiku-20240307',
+        'prompt': PROMPT,
+        'base_prompt': PROMPT,
+    }
+    settings.update(overrides)
+    return cache.key(path, **settings)
+
+
+def bump_mtime(path):
+    """Move mtime forward far enough for coarse filesystem timestamps"""
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_same_request_gives_same_key(cache, image):
+    assert key(cache, image) == key(cache, image)
+
+
+def test_copied_file_shares_key(cache, image, tmp_path):
+    copy = tmp_path / 'renamed.jpg'
+    shutil.copy(image, copy)
+    assert key(cache, copy) == key(cache, image)
+
+
+def test_edited_pixels_change_key(cache, image):
+    before = key(cache, image)
+    write_image(image, color='white')
+    bump_mtime(image)
+    assert key(cache, image) != before
+
+
+@pytest.mark.parametrize('name, save_args', [
+    ('photo.jpg', {'quality': 90}),
+    ('photo.jpg', {'quality': 90, 'progressive': True}),
+    ('photo.tif', {}),
+    ('photo.png', {}),
+])
+def test_metadata_changes_keep_key(cache, tmp_path, name, save_args):
+    # What --embed does: same pixels, different metadata
+    exif = Image.Exif()
+    exif[0x010E] = "A caption written into the file"
+    plain = write_image(tmp_path / name, **save_args)
+    tagged = write_image(tmp_path / f"tagged_{name}", exif=exif, **save_args)
+    assert plain.read_bytes() != tagged.read_bytes()
+    assert key(cache, tagged) == key(cache, plain)
+
+
+def test_jpeg_comment_and_trailer_keep_key(cache, image, tmp_path):
+    data = image.read_bytes()
+    edited = tmp_path / 'edited.jpg'
+    edited.write_bytes(data[:2] + b'\xff\xfe\x00\x09comment' + data[2:] + b'trailer')
+    assert key(cache, edited) == key(cache, image)
+
+
+def test_unparseable_file_hashed_whole(cache, tmp_path):
+    first = tmp_path / 'first.jpg'
+    second = tmp_path / 'second.jpg'
+    first.write_bytes(b'\xff\xd8truncated')
+    second.write_bytes(b'\xff\xd8also truncated')
+    assert key(cache, first) != key(cache, second)
+
+
+@pytest.mark.parametrize('setting, value', [
+    ('provider', 'openai'),
+    ('model', 'claude-opus-4-5-20251101'),
+    ('prompt', PROMPT + "\n\nLocation: Paris, France"),
+    ('base_prompt', "Write a poetic, evocative caption."),
+])
+def test_settings_change_key(cache, image, setting, value):
+    assert key(cache, image, **{setting: value}) != key(cache, image)
+
+
+def test_get_and_set(cache, image):
+    k = key(cache, image)
+    assert cache.get(k) is None
+    cache.set(k, 'A caption')
+    assert cache.get(k) == 'A caption'
+    assert cache.get(key(cache, image, provider='openai')) is None
+
+
+def test_cache_persists(tmp_path, image):
+    k = key(CaptionCache(tmp_path / 'cache'), image)
+    CaptionCache(tmp_path / 'cache').set(k, 'A caption')
+    assert CaptionCache(tmp_path / 'cache').get(k) == 'A caption'
+
+
+def test_contains_ignores_location(cache, image):
+    model = 'claude-3-haiku-20240307'
+    assert not cache.contains(image, 'claude', model, PROMPT)
+    cache.set(key(cache, image, prompt=PROMPT + "\n\nLocation: Oslo"), 'A caption')
+    assert cache.contains(image, 'claude', model, PROMPT)
+    assert not cache.contains(image, 'claude', model, "Another prompt")
+    assert not cache.contains(image, 'openai', model, PROMPT)
+
+
+@pytest.fixture
+def generator(cache, monkeypatch):
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test-key')
+    return CaptionGenerator(cache=cache)
+
+
+def test_generator_keys_on_prompt_text(generator, cache, image):
+    before = generator._cache_key(image, 'minimal', None, None)
+    generator.STYLES = {**generator.STYLES, 'minimal': "Write one word."}
+    generator._build_prompt.cache_clear()
+    assert generator._cache_key(image, 'minimal', None, None) != before
+
+
+def test_generator_keys_on_resolved_model(generator, image):
+    # 'descriptive' defaults to haiku, so naming it explicitly is the same
+    # request
+    assert (generator._cache_key(image, 'descriptive', None, None)
+            == generator._cache_key(image, 'descriptive', 'haiku', None))
+    assert (generator._cache_key(image, 'descriptive', None, None)
+            != generator._cache_key(image, 'descriptive', 'opus', None))
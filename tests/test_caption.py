@@ -0,0 +1,105 @@
+"""Tests for caption generation"""
+
+import base64
+import os
+from collections import OrderedDict
+
+import pytest
+from PIL import Image
+
+from dng_caption import caption
+from dng_caption.caption import CaptionGenerator
+
+
+@pytest.fixture
+def encodes(monkeypatch):
+    """Record every image actually encoded, with an empty JPEG memo"""
+    monkeypatch.setattr(caption, '_jpeg_cache', OrderedDict())
+    calls = []
+    encode = caption._encode_jpeg
+
+    def counting_encode(source, max_size):
+        calls.append(source)
+        return encode(source, max_size)
+
+    monkeypatch.setattr(caption, '_encode_jpeg', counting_encode)
+    return calls
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test-key')
+    return CaptionGenerator(provider='claude')
+
+
+def write_image(path, color='gray'):
+    Image.new('RGB', (64, 48), color).save(path)
+    return path
+
+
+def bump_mtime(path):
+    """Move mtime forward far enough for coarse filesystem timestamps"""
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_jpeg_memo_reused(generator, encodes, tmp_path):
+    path = write_image(tmp_path / 'a.jpg')
+    first = generator._encode_jpeg_bytes(path)
+    # Opened images of the same file share the entry
+    with Image.open(path) as img:
+        assert generator._encode_jpeg_bytes(img) == first
+    assert generator._prepare_image(path) == base64.b64encode(first).decode('utf-8')
+    assert len(encodes) == 1
+
+
+def test_jpeg_memo_invalidated_by_mtime(generator, encodes, tmp_path):
+    path = write_image(tmp_path / 'a.jpg')
+    generator._encode_jpeg_bytes(path)
+    bump_mtime(path)
+    generator._encode_jpeg_bytes(path)
+    assert len(encodes) == 2
+
+
+def test_jpeg_memo_invalidated_by_size(generator, encodes, tmp_path):
+    path = write_image(tmp_path / 'a.jpg')
+    generator._encode_jpeg_bytes(path)
+    stat = path.stat()
+    Image.new('RGB', (128, 96), 'white').save(path)
+    # Same mtime, so only the size tells the files apart
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert path.stat().st_size != stat.st_size
+
+    output = tmp_path / 'out.jpg'
+    output.write_bytes(generator._encode_jpeg_bytes(path))
+    with Image.open(output) as img:
+        assert img.size == (128, 96)
+    assert len(encodes) == 2
+
+
+def test_jpeg_memo_evicts_least_recently_used(generator, encodes, tmp_path,
+                                              monkeypatch):
+    monkeypatch.setattr(caption, '_JPEG_CACHE_SIZE', 2)
+    a, b, c = (write_image(tmp_path / f"{name}.jpg") for name in 'abc')
+    generator._encode_jpeg_bytes(a)
+    generator._encode_jpeg_bytes(b)
+    # Touching a makes b the oldest entry
+    generator._encode_jpeg_bytes(a)
+    generator._encode_jpeg_bytes(c)
+    assert len(caption._jpeg_cache) == 2
+    assert len(encodes) == 3
+
+    generator._encode_jpeg_bytes(a)
+    assert len(encodes) == 3
+    generator._encode_jpeg_bytes(b)
+    assert len(encodes) == 4
+
+
+def test_jpeg_memo_skips_in_memory_images(generator, encodes):
+    img = Image.new('RGB', (64, 48), 'gray')
+    first = generator._encode_jpeg_bytes(img)
+    assert generator._encode_jpeg_bytes(img) == first
+    assert len(encodes) == 2
+    assert not caption._jpeg_cache
+    # The caller's image isn't resized in place
+    assert img.size == (64, 48)
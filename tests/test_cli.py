@@ -0,0 +1,138 @@
+"""Tests for the command-line interface"""
+
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from dng_caption.cli import _StreamPrinter, _process_images, main
+
+
+def output(capsys):
+    return capsys.readouterr().out
+
+
+def test_head_streams_live(capsys):
+    printer = _StreamPrinter(2)
+    printer.write(0, "a.jpg: ")
+    printer.write(0, "A caption")
+    assert output(capsys) == "a.jpg: A caption"
+    printer.finish(0)
+    assert output(capsys) == "\n"
+
+
+def test_later_image_finishing_first_waits_for_head(capsys):
+    printer = _StreamPrinter(2)
+    printer.write(1, "b.jpg: ")
+    printer.write(1, "Second")
+    printer.finish(1)
+    assert output(capsys) == ""
+
+    printer.write(0, "a.jpg: First")
+    assert output(capsys) == "a.jpg: First"
+    printer.finish(0)
+    assert output(capsys) == "\nb.jpg: Second\n"
+
+
+def test_run_of_finished_images_flushed_with_head(capsys):
+    printer = _StreamPrinter(4)
+    for index in (1, 2):
+        printer.write(index, f"image {index}")
+        printer.finish(index)
+    # Started but not finished: flushed so far, then streams live
+    printer.write(3, "image 3 part")
+    assert output(capsys) == ""
+
+    printer.write(0, "image 0")
+    printer.finish(0)
+    assert output(capsys) == "image 0\nimage 1\nimage 2\nimage 3 part"
+    printer.write(3, " two")
+    assert output(capsys) == " two"
+    printer.finish(3)
+    assert output(capsys) == "\n"
+
+
+def test_failure_after_partial_output(capsys):
+    printer = _StreamPrinter(2)
+    printer.write(0, "a.jpg: Half a cap")
+    printer.fail(0, "✗ a.jpg: connection reset")
+    printer.write(1, "b.jpg: Fine")
+    printer.finish(1)
+    assert output(capsys) == (
+        "a.jpg: Half a cap\n✗ a.jpg: connection reset\nb.jpg: Fine\n"
+    )
+
+
+def test_failure_before_output_and_out_of_order(capsys):
+    printer = _StreamPrinter(3)
+    printer.fail(2, "File not found: c.jpg")
+    printer.fail(1, "✗ b.jpg: bad image")
+    assert output(capsys) == ""
+    printer.write(0, "a.jpg: Done")
+    printer.finish(0)
+    assert output(capsys) == (
+        "a.jpg: Done\n✗ b.jpg: bad image\nFile not found: c.jpg\n"
+    )
+
+
+@pytest.mark.parametrize('order', [(0, 1, 2), (2, 1, 0), (1, 2, 0), (2, 0, 1)])
+def test_output_always_in_input_order(capsys, order):
+    printer = _StreamPrinter(3)
+    for index in order:
+        printer.write(index, f"{index}: caption {index}")
+        printer.finish(index)
+    assert output(capsys) == "0: caption 0\n1: caption 1\n2: caption 2\n"
+
+
+class FakeGenerator:
+    """Streams a canned caption per image, slower for earlier images"""
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.active = 0
+        self.peak = 0
+
+    async def generate_async(self, image, style, model, location_context,
+                             on_text=None):
+        name = Path(image.filename).name
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            for word in ('Caption ', 'for ', name):
+                await asyncio.sleep(self.delays[name])
+                on_text(word)
+        finally:
+            self.active -= 1
+        return f"Caption for {name}"
+
+
+def test_stream_keeps_concurrency_and_order(tmp_path, capsys):
+    names = ['a.jpg', 'b.jpg', 'c.jpg']
+    for name in names:
+        Image.new('RGB', (8, 8)).save(tmp_path / name)
+    generator = FakeGenerator({'a.jpg': 0.03, 'b.jpg': 0.01, 'c.jpg': 0.0})
+    args = SimpleNamespace(
+        images=[str(tmp_path / name) for name in names] + [str(tmp_path / 'x.jpg')],
+        stream=True, concurrency=3, style='descriptive', model=None
+    )
+
+    asyncio.run(_process_images(args, generator, None, None))
+
+    assert generator.peak == 3
+    assert output(capsys) == (
+        "a.jpg: Caption for a.jpg\n"
+        "b.jpg: Caption for b.jpg\n"
+        "c.jpg: Caption for c.jpg\n"
+        f"File not found: {tmp_path / 'x.jpg'}\n"
+    )
+
+
+@pytest.mark.parametrize('option', ['--rpm', '--tpm'])
+def test_rate_limits_must_be_positive(monkeypatch, capsys, option):
+    monkeypatch.setattr('sys.argv', ['dng-caption', option, '0', 'a.jpg'])
+    with pytest.raises(SystemExit) as excinfo:
+        main()
+    assert excinfo.value.code == 2
+    assert 'must be at least 1' in capsys.readouterr().err
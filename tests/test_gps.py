@@ -0,0 +1,226 @@
+"""Tests for GPS extraction and reverse geocoding"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from PIL import ExifTags, Image
+from PIL.TiffImagePlugin import IFDRational
+
+from dng_caption import gps
+from dng_caption.gps import GPSExtractor
+
+
+@pytest.fixture
+def extractor():
+    return GPSExtractor(cache_dir=None)
+
+
+@pytest.fixture(params=['numpy', 'no-numpy'])
+def numpy_mode(request, monkeypatch):
+    """Run a test with and without the optional numpy fast path"""
+    if request.param == 'numpy':
+        if gps.np is None:
+            pytest.skip("numpy not installed")
+    else:
+        monkeypatch.setattr(gps, 'np', None)
+    return request.param
+
+
+def write_image(path, lat=None, lat_ref='N', lon=None, lon_ref='E', altitude=None):
+    """Save a small image, with a GPS IFD if coordinates are given"""
+    exif = Image.Exif()
+    if lat is not None:
+        ifd = {
+            ExifTags.GPS.GPSLatitudeRef: lat_ref,
+            ExifTags.GPS.GPSLatitude: tuple(IFDRational(*v) for v in lat),
+            ExifTags.GPS.GPSLongitudeRef: lon_ref,
+            ExifTags.GPS.GPSLongitude: tuple(IFDRational(*v) for v in lon),
+        }
+        if altitude is not None:
+            ifd[ExifTags.GPS.GPSAltitude] = IFDRational(*altitude)
+        exif[ExifTags.IFD.GPSInfo] = ifd
+    Image.new('RGB', (16, 16), 'gray').save(path, exif=exif)
+    return path
+
+
+@pytest.fixture
+def images(tmp_path):
+    return [
+        write_image(tmp_path / 'north_east.jpg',
+                    lat=((48, 1), (51, 1), (2952, 100)),
+                    lon=((2, 1), (17, 1), (4020, 100)),
+                    altitude=(3550, 100)),
+        write_image(tmp_path / 'south_west.jpg',
+                    lat=((33, 1), (52, 1), (0, 1)), lat_ref='S',
+                    lon=((151, 1), (12, 1), (30, 1)), lon_ref='W'),
+        write_image(tmp_path / 'no_gps.jpg'),
+        # Not read by exifread, goes through the Pillow fallback
+        write_image(tmp_path / 'north_east.png',
+                    lat=((48, 1), (51, 1), (2952, 100)),
+                    lon=((2, 1), (17, 1), (4020, 100))),
+        tmp_path / 'missing.jpg',
+    ]
+
+
+def test_extract_gps_converts_to_degrees(extractor, images):
+    result = extractor.extract_gps(images[0])
+    assert result['latitude'] == pytest.approx(48 + 51 / 60 + 29.52 / 3600)
+    assert result['longitude'] == pytest.approx(2 + 17 / 60 + 40.2 / 3600)
+    assert result['altitude'] == pytest.approx(35.5)
+
+
+def test_extract_gps_applies_refs(extractor, images):
+    result = extractor.extract_gps(images[1])
+    assert result['latitude'] == pytest.approx(-(33 + 52 / 60))
+    assert result['longitude'] == pytest.approx(-(151 + 12 / 60 + 30 / 3600))
+    assert 'altitude' not in result
+
+
+def test_extract_gps_without_position(extractor, images):
+    assert extractor.extract_gps(images[2]) is None
+    assert extractor.extract_gps(images[4]) is None
+
+
+def test_jpeg_without_exif_parsed_once(extractor, images, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("JPEG reopened with Pillow")
+
+    monkeypatch.setattr(gps.Image, 'open', fail)
+    assert extractor._read_gps(images[2]) is None
+
+
+def test_extract_gps_reads_png_through_pillow(extractor, images, capfd):
+    result = extractor.extract_gps(images[3])
+    assert result['latitude'] == pytest.approx(48 + 51 / 60 + 29.52 / 3600)
+    # exifread would have warned about the PNG on stderr
+    assert capfd.readouterr().err == ''
+
+
+def test_extract_gps_from_open_image(extractor, images):
+    with Image.open(images[0]) as img:
+        assert extractor.extract_gps(img) == extractor.extract_gps(images[0])
+
+
+def test_batch_matches_single(extractor, images, numpy_mode):
+    expected = [extractor.extract_gps(path) for path in images]
+    assert extractor.extract_gps_batch(images) == expected
+
+
+def test_batch_empty(extractor, numpy_mode):
+    assert extractor.extract_gps_batch([]) == []
+
+
+@pytest.mark.parametrize('raw', [
+    # Zero denominator in a coordinate
+    (((48, 1), (51, 0), (0, 1)), 'N', ((2, 1), (17, 1), (0, 1)), 'E', None),
+    (((48, 1), (51, 1), (0, 1)), 'N', ((2, 1), (17, 1), (0, 0)), 'E', None),
+    # Zero denominator in the altitude
+    (((48, 1), (51, 1), (0, 1)), 'N', ((2, 1), (17, 1), (0, 1)), 'E', (10, 0)),
+    # Valid, for contrast
+    (((48, 1), (51, 1), (0, 1)), 'S', ((2, 1), (17, 1), (0, 1)), 'W', (10, 4)),
+])
+def test_batch_matches_single_on_raw_tags(extractor, monkeypatch, numpy_mode, raw):
+    monkeypatch.setattr(extractor, '_read_gps', lambda path: raw)
+    assert extractor.extract_gps_batch(['a', 'b']) == [extractor.extract_gps('a')] * 2
+
+
+def test_zero_denominator_gives_none(extractor, monkeypatch, numpy_mode):
+    raw = (((48, 1), (51, 0), (0, 1)), 'N', ((2, 1), (17, 1), (0, 1)), 'E', None)
+    monkeypatch.setattr(extractor, '_read_gps', lambda path: raw)
+    assert extractor.extract_gps('a') is None
+    assert extractor.extract_gps_batch(['a']) == [None]
+
+
+class FakeNominatim:
+    """Stands in for geolocator.reverse, counting requests
+
+    answers is consumed one per request; None means nothing was found.
+    """
+
+    def __init__(self, answers=None, delay=0):
+        self.answers = list(answers or [])
+        self.delay = delay
+        self.queries = []
+
+    def __call__(self, query, timeout, language):
+        self.queries.append(query)
+        time.sleep(self.delay)
+        city = self.answers.pop(0) if self.answers else 'Paris'
+        if city is None:
+            return None
+        return SimpleNamespace(
+            raw={'address': {'city': city, 'country': 'France'}},
+            address=f"{city}, France"
+        )
+
+
+@pytest.fixture
+def geocoder(tmp_path):
+    """An extractor with a disk cache whose Nominatim requests are faked"""
+    extractor = GPSExtractor(cache_dir=tmp_path / 'geocode')
+    nominatim = FakeNominatim()
+    extractor._reverse.func = nominatim
+    extractor._reverse.min_delay_seconds = 0
+    return extractor, nominatim
+
+
+def test_reverse_geocode_rounds_to_three_decimals(geocoder):
+    extractor, nominatim = geocoder
+    first = extractor.reverse_geocode(48.85661, 2.35222)
+    second = extractor.reverse_geocode(48.85651, 2.35178)
+    assert first == second
+    assert first['formatted'] == 'Paris, France'
+    assert nominatim.queries == ['48.857, 2.352']
+    assert extractor.reverse_geocode(48.8580, 2.352) is not None
+    assert len(nominatim.queries) == 2
+
+
+def test_reverse_geocode_reads_disk_cache(geocoder):
+    extractor, nominatim = geocoder
+    cached = {'formatted': 'Lyon, France', 'city': 'Lyon', 'state': None,
+              'country': 'France', 'full_address': 'Lyon, France'}
+    extractor.cache.set((45.764, 4.836), cached)
+    assert extractor.reverse_geocode(45.76404, 4.83566) == cached
+    assert nominatim.queries == []
+
+
+def test_reverse_geocode_persists_to_disk(tmp_path, geocoder):
+    extractor, nominatim = geocoder
+    result = extractor.reverse_geocode(48.857, 2.352)
+    # A new process: empty memory cache, same disk cache
+    reopened = GPSExtractor(cache_dir=tmp_path / 'geocode')
+    reopened._reverse.func = FakeNominatim(['Elsewhere'])
+    assert reopened.reverse_geocode(48.857, 2.352) == result
+    assert reopened._reverse.func.queries == []
+
+
+def test_reverse_geocode_failures_not_cached(geocoder):
+    extractor, nominatim = geocoder
+    nominatim.answers = [None, None, 'Paris']
+    # Both retries find nothing
+    assert extractor.reverse_geocode(48.857, 2.352) is None
+    assert (48.857, 2.352) not in extractor.cache
+    assert extractor.reverse_geocode(48.857, 2.352)['city'] == 'Paris'
+    assert len(nominatim.queries) == 3
+
+
+def test_reverse_geocode_dedupes_concurrent_lookups(geocoder):
+    extractor, nominatim = geocoder
+    nominatim.delay = 0.05
+    results = []
+
+    def lookup(lat):
+        results.append(extractor.reverse_geocode(lat, 2.352))
+
+    threads = [threading.Thread(target=lookup, args=(lat,))
+               for lat in (48.8571, 48.8569, 48.857, 45.764)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # One request per rounded spot, however many callers wanted it
+    assert sorted(nominatim.queries) == ['45.764, 2.352', '48.857, 2.352']
+    assert all(result['city'] == 'Paris' for result in results)
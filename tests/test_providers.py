@@ -0,0 +1,327 @@
+"""Tests for provider batch handling, against fake API clients"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from dng_caption.cache import CaptionCache
+from dng_caption.caption import CaptionGenerator
+from dng_caption.providers import (
+    PROVIDERS, ClaudeAdapter, OpenAIAdapter, ProviderAdapter
+)
+
+
+class FakeMessageBatches:
+    """messages.batches of an Anthropic client
+
+    outcomes maps custom_id to a result type; the rest succeed.
+    """
+
+    def __init__(self, outcomes=None, interrupt_on=None):
+        self.outcomes = outcomes or {}
+        self.interrupt_on = interrupt_on
+        self.requests = {}
+        self.cancelled = []
+
+    def create(self, requests):
+        batch_id = f"msgbatch_{len(self.requests)}"
+        self.requests[batch_id] = requests
+        return SimpleNamespace(id=batch_id, processing_status='in_progress')
+
+    def retrieve(self, batch_id):
+        if batch_id == self.interrupt_on:
+            raise KeyboardInterrupt
+        return SimpleNamespace(id=batch_id, processing_status='ended')
+
+    def results(self, batch_id):
+        for request in self.requests[batch_id]:
+            outcome = self.outcomes.get(request['custom_id'], 'succeeded')
+            message = SimpleNamespace(content=[
+                SimpleNamespace(text=f" Caption for {request['custom_id']} ")
+            ])
+            yield SimpleNamespace(
+                custom_id=request['custom_id'],
+                result=SimpleNamespace(type=outcome, message=message)
+            )
+
+    def cancel(self, batch_id):
+        self.cancelled.append(batch_id)
+
+
+class FakeOpenAI:
+    """files and batches of an OpenAI client"""
+
+    def __init__(self, output_lines, error_lines=(), status='completed'):
+        self.output_lines = output_lines
+        self.error_lines = error_lines
+        self.status = status
+        self.uploads = []
+        self.cancelled = []
+        self.files = SimpleNamespace(create=self._upload, content=self._content)
+        self.batches = SimpleNamespace(
+            create=self._create, retrieve=self._retrieve, cancel=self.cancelled.append
+        )
+
+    def _upload(self, file, purpose):
+        assert purpose == 'batch'
+        self.uploads.append(file[1].decode('utf-8'))
+        return SimpleNamespace(id=f"file-{len(self.uploads)}")
+
+    def _create(self, input_file_id, endpoint, completion_window):
+        return SimpleNamespace(id=f"batch_{input_file_id}")
+
+    def _retrieve(self, batch_id):
+        return SimpleNamespace(
+            id=batch_id,
+            status=self.status,
+            output_file_id='out' if self.output_lines else None,
+            error_file_id='err' if self.error_lines else None
+        )
+
+    def _content(self, file_id):
+        lines = self.output_lines if file_id == 'out' else self.error_lines
+        return SimpleNamespace(text='\n'.join(json.dumps(line) for line in lines))
+
+
+def openai_success(custom_id, text):
+    return {
+        'custom_id': custom_id,
+        'response': {
+            'status_code': 200,
+            'body': {'choices': [{'message': {'content': text}}]}
+        },
+        'error': None
+    }
+
+
+def run(adapter, client, payloads):
+    return dict(adapter.run_batch(client, payloads.items(), poll_interval=0))
+
+
+@pytest.fixture
+def payloads():
+    return {f"image-{i}": {'model': 'm', 'messages': [i]} for i in range(5)}
+
+
+def test_claude_batch_results(payloads):
+    batches = FakeMessageBatches(outcomes={'image-1': 'errored', 'image-3': 'expired'})
+    results = run(ClaudeAdapter(), SimpleNamespace(messages=SimpleNamespace(batches=batches)),
+                  payloads)
+
+    assert results['image-0'] == 'Caption for image-0'
+    assert isinstance(results['image-1'], RuntimeError)
+    assert 'errored' in str(results['image-1'])
+    assert isinstance(results['image-3'], RuntimeError)
+    assert sorted(results) == sorted(payloads)
+    [requests] = batches.requests.values()
+    assert requests[2] == {'custom_id': 'image-2', 'params': payloads['image-2']}
+
+
+def test_claude_batch_split_by_request_count(payloads, monkeypatch):
+    monkeypatch.setattr(ClaudeAdapter, 'BATCH_MAX_REQUESTS', 2)
+    batches = FakeMessageBatches()
+    results = run(ClaudeAdapter(), SimpleNamespace(messages=SimpleNamespace(batches=batches)),
+                  payloads)
+
+    assert [len(r) for r in batches.requests.values()] == [2, 2, 1]
+    assert sorted(results) == sorted(payloads)
+
+
+def test_claude_batch_split_by_size(payloads, monkeypatch):
+    size = len(json.dumps(payloads['image-0'])) + 256
+    monkeypatch.setattr(ClaudeAdapter, 'BATCH_MAX_BYTES', size * 3)
+    batches = FakeMessageBatches()
+    run(ClaudeAdapter(), SimpleNamespace(messages=SimpleNamespace(batches=batches)), payloads)
+
+    assert [len(r) for r in batches.requests.values()] == [3, 2]
+
+
+def test_claude_batch_cancelled_on_interrupt(payloads, monkeypatch):
+    monkeypatch.setattr(ClaudeAdapter, 'BATCH_MAX_REQUESTS', 2)
+    batches = FakeMessageBatches(interrupt_on='msgbatch_1')
+    client = SimpleNamespace(messages=SimpleNamespace(batches=batches))
+
+    with pytest.raises(KeyboardInterrupt):
+        run(ClaudeAdapter(), client, payloads)
+    # The first batch had already ended; the rest were still running
+    assert batches.cancelled == ['msgbatch_1', 'msgbatch_2']
+
+
+def test_openai_batch_results(payloads):
+    client = FakeOpenAI(
+        output_lines=[
+            openai_success('image-0', ' A caption '),
+            {
+                'custom_id': 'image-1',
+                'response': {'status_code': 400,
+                             'body': {'error': {'message': 'bad image'}}},
+                'error': None
+            },
+        ],
+        error_lines=[
+            {'custom_id': 'image-2', 'response': None,
+             'error': {'code': 'batch_expired'}},
+        ]
+    )
+    results = run(OpenAIAdapter(), client, payloads)
+
+    assert results['image-0'] == 'A caption'
+    assert 'bad image' in str(results['image-1'])
+    assert 'batch_expired' in str(results['image-2'])
+    [upload] = client.uploads
+    first = json.loads(upload.splitlines()[0])
+    assert first == {
+        'custom_id': 'image-0',
+        'method': 'POST',
+        'url': '/v1/chat/completions',
+        'body': payloads['image-0']
+    }
+
+
+def test_openai_batch_split_by_request_count(payloads, monkeypatch):
+    monkeypatch.setattr(OpenAIAdapter, 'BATCH_MAX_REQUESTS', 3)
+    client = FakeOpenAI(output_lines=[])
+    run(OpenAIAdapter(), client, payloads)
+
+    assert [len(upload.splitlines()) for upload in client.uploads] == [3, 2]
+
+
+def test_openai_batch_without_output_files(payloads):
+    client = FakeOpenAI(output_lines=[], status='failed')
+    assert run(OpenAIAdapter(), client, payloads) == {}
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    paths = []
+    for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+        path = tmp_path / name
+        Image.new('RGB', (64, 48), 'gray').save(path)
+        paths.append(path)
+    return paths
+
+
+def test_generate_batch(image_paths, monkeypatch):
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test-key')
+    generator = CaptionGenerator(provider='claude')
+    batches = FakeMessageBatches(outcomes={'image-1': 'errored'})
+    generator.client = SimpleNamespace(messages=SimpleNamespace(batches=batches))
+
+    items = [(path, None) for path in image_paths]
+    items.append((image_paths[0].parent / 'missing.jpg', None))
+    results = dict(generator.generate_batch(items, style='minimal'))
+
+    assert results[image_paths[0]] == 'Caption for image-0'
+    assert isinstance(results[image_paths[1]], RuntimeError)
+    assert results[image_paths[2]] == 'Caption for image-2'
+    # Failed before submission, so never part of the batch
+    assert isinstance(results[items[3][0]], Exception)
+    [requests] = batches.requests.values()
+    assert [r['custom_id'] for r in requests] == ['image-0', 'image-1', 'image-2']
+    assert requests[0]['params']['model'] == CaptionGenerator.CLAUDE_MODELS['haiku']['name']
+
+
+def test_generate_batch_reports_missing_results(image_paths, monkeypatch):
+    monkeypatch.setenv('OPENAI_API_KEY', 'test-key')
+    generator = CaptionGenerator(provider='openai')
+    generator.client = FakeOpenAI(output_lines=[openai_success('image-0', 'A caption')])
+
+    results = dict(generator.generate_batch([(path, None) for path in image_paths]))
+
+    assert results[image_paths[0]] == 'A caption'
+    assert 'No result' in str(results[image_paths[1]])
+    assert 'No result' in str(results[image_paths[2]])
+
+
+class FailingMessageBatches(FakeMessageBatches):
+    """Rejects the batch created after `accepted` others"""
+
+    def __init__(self, accepted=0):
+        super().__init__()
+        self.accepted = accepted
+
+    def create(self, requests):
+        if len(self.requests) >= self.accepted:
+            raise RuntimeError("413 request_too_large")
+        return super().create(requests)
+
+
+def test_generate_batch_reports_submit_failure(image_paths, tmp_path, monkeypatch):
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test-key')
+    monkeypatch.setattr(ClaudeAdapter, 'BATCH_MAX_REQUESTS', 1)
+    generator = CaptionGenerator(provider='claude', cache=CaptionCache(tmp_path / 'cache'))
+    # The fixture images share their pixels, and so their cache key
+    Image.new('RGB', (64, 48), 'white').save(image_paths[2])
+    cached = generator._cache_key(image_paths[2], 'minimal', None, None)
+    generator.cache.set(cached, 'Cached caption')
+    batches = FailingMessageBatches(accepted=1)
+    generator.client = SimpleNamespace(messages=SimpleNamespace(batches=batches))
+
+    results = dict(generator.generate_batch([(path, None) for path in image_paths],
+                                            style='minimal'))
+
+    assert results[image_paths[2]] == 'Cached caption'
+    for path in image_paths[:2]:
+        assert 'request_too_large' in str(results[path])
+    # The batch that did get submitted isn't left running
+    assert batches.cancelled == ['msgbatch_0']
+
+
+def test_generate_batch_builds_payloads_per_batch(image_paths, monkeypatch):
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test-key')
+    monkeypatch.setattr(ClaudeAdapter, 'BATCH_MAX_REQUESTS', 1)
+    generator = CaptionGenerator(provider='claude')
+    built = []
+    payload = generator._payload
+    monkeypatch.setattr(generator, '_payload',
+                        lambda *args: built.append(args[0]) or payload(*args))
+    built_at_submit = []
+    batches = FakeMessageBatches()
+    create = batches.create
+    batches.create = lambda requests: built_at_submit.append(len(built)) or create(requests)
+    generator.client = SimpleNamespace(messages=SimpleNamespace(batches=batches))
+
+    results = dict(generator.generate_batch([(path, None) for path in image_paths]))
+
+    # A job is submitted once the next payload no longer fits in it
+    assert built_at_submit == [2, 3, 3]
+    assert sorted(results) == sorted(image_paths)
+
+
+class EchoAdapter(ClaudeAdapter):
+    """A new provider built on the Claude request shape"""
+
+    label = 'Echo'
+    vendor = 'Echo Inc.'
+    api_key_env = 'ECHO_API_KEY'
+    MODELS = {'small': {'name': 'echo-small', 'cost': 0, 'description': 'Test'}}
+
+    def default_model(self, style):
+        return 'small'
+
+
+def test_adapter_interface_is_enforced():
+    class Incomplete(ProviderAdapter):
+        label = 'Incomplete'
+        vendor = 'Nobody'
+        api_key_env = 'NONE'
+        MODELS = {}
+
+    with pytest.raises(TypeError) as excinfo:
+        Incomplete()
+    # Batch limits have to be set explicitly
+    assert 'BATCH_MAX_BYTES' in str(excinfo.value)
+    assert 'build_payload' in str(excinfo.value)
+
+
+def test_registered_adapter_is_usable(monkeypatch, image_paths):
+    monkeypatch.setitem(PROVIDERS, 'echo', EchoAdapter())
+    monkeypatch.setenv('ECHO_API_KEY', 'test-key')
+    generator = CaptionGenerator(provider='echo')
+
+    payload = generator._payload(image_paths[0], 'minimal', None, None)
+    assert payload['model'] == 'echo-small'
+    with pytest.raises(ValueError, match="'echo'"):
+        CaptionGenerator(provider='gemini')
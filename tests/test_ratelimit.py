@@ -0,0 +1,85 @@
+"""Tests for the client-side rate limiter"""
+
+import asyncio
+import time
+
+import pytest
+
+from dng_caption.ratelimit import RateLimiter
+
+WINDOW = 0.2
+
+
+@pytest.fixture(autouse=True)
+def short_window(monkeypatch):
+    """Shrink the sliding window so waits take fractions of a second"""
+    monkeypatch.setattr(RateLimiter, 'WINDOW', WINDOW)
+
+
+def acquire_times(limiter, costs):
+    """Acquire each cost in turn, returning seconds elapsed at each grant"""
+    async def run():
+        start = time.monotonic()
+        times = []
+        for tokens in costs:
+            await limiter.acquire(tokens)
+            times.append(time.monotonic() - start)
+        return times
+
+    return asyncio.run(run())
+
+
+def test_requests_within_limits_do_not_wait():
+    times = acquire_times(RateLimiter(rpm=3, tpm=1000), [100, 100, 100])
+    assert times[-1] < WINDOW / 2
+
+
+def test_rpm_limit_waits_for_window():
+    times = acquire_times(RateLimiter(rpm=2, tpm=1000), [1, 1, 1])
+    assert times[1] < WINDOW / 2
+    assert times[2] >= WINDOW * 0.9
+
+
+def test_tpm_limit_waits_for_window():
+    times = acquire_times(RateLimiter(rpm=100, tpm=100), [60, 30, 20])
+    assert times[1] < WINDOW / 2
+    assert times[2] >= WINDOW * 0.9
+
+
+def test_oversized_request_is_clamped_to_tpm():
+    limiter = RateLimiter(rpm=100, tpm=100)
+    times = acquire_times(limiter, [500])
+    assert times[0] < WINDOW / 2
+    assert limiter._tokens == 100
+
+
+def test_old_reservations_are_evicted():
+    limiter = RateLimiter(rpm=1, tpm=1000)
+    acquire_times(limiter, [10])
+    time.sleep(WINDOW)
+    times = acquire_times(limiter, [10])
+    assert times[0] < WINDOW / 2
+    assert len(limiter._window) == 1
+
+
+def test_concurrent_callers_share_the_limit():
+    limiter = RateLimiter(rpm=2, tpm=1000)
+
+    async def run():
+        start = time.monotonic()
+
+        async def one():
+            await limiter.acquire(1)
+            return time.monotonic() - start
+
+        return sorted(await asyncio.gather(*(one() for _ in range(4))))
+
+    times = asyncio.run(run())
+    assert times[1] < WINDOW / 2
+    assert times[2] >= WINDOW * 0.9
+
+
+@pytest.mark.parametrize('rpm, tpm', [(0, 100), (10, 0), (-1, -1)])
+def test_invalid_limits_raise(rpm, tpm):
+    with pytest.raises(ValueError):
+        RateLimiter(rpm=rpm, tpm=tpm)